@@ -0,0 +1,431 @@
+"""Shared constants, parsers, and helpers for the NR Hydrogen Maser monitor."""
+
+import os
+import re
+import time
+
+import logging
+
+from datetime import datetime, timedelta, timezone
+
+logfilename = "/var/log/maser.log"
+metrics_dir = "/var/lib/node_exporter/textfile_collector/"
+metrics_prefix = "maser"
+
+class CachedTimestampFormatter(logging.Formatter):
+    """Log formatter that caches the formatted timestamp per whole second.
+
+    Many log records share the same wall-clock second, so the strftime call
+    in formatTime can be skipped until the second ticks over.
+    """
+
+    def __init__(self, fmt=None, datefmt=None):
+        super().__init__(fmt, datefmt)
+        self.last_second = None
+        self.last_asctime = ""
+
+    def formatTime(self, record, datefmt=None):
+        second = int(record.created)
+        if second != self.last_second:
+            self.last_second = second
+            self.last_asctime = time.strftime(datefmt, time.localtime(second))
+        return self.last_asctime
+
+
+# Create logger
+logger = logging.getLogger(__name__)
+logfmt = CachedTimestampFormatter("%(asctime)s %(message)s", "%Y-%m-%d %H:%M:%S")
+
+logfile_handler = logging.FileHandler(logfilename)
+logfile_handler.setFormatter(logfmt)
+logger.addHandler(logfile_handler)
+
+logger.setLevel(logging.DEBUG)
+
+
+analog_chan_sets = {
+    "VOLTAGES": ["  p28  ", "  p18  ", "  p5   ", "  n18  ", "VACION ", "THRMREF", "  p00  ", " p2 REF"],
+    "BUFFERS ": ["RCVR1  ", "TRANS  ", "SYNTH  ", "DIST   ", "  1    ", "  2    ", "  3    ", "  4    "],
+    "MULT SEN": ["1p4 GHZ", "400KHZ ", "200MRC ", "20MHZ  ", "200MRF ", "200MLP ", "20 MMLT", "10 REF "],
+    "CURRENTS": ["  p28  ", "BATCHG ", "VACPMP ", "SOURCE ", "STSEL  ", "H2PUR  "],
+    "HEATERS ": [" RCVR  ", "MNCYL  ", "LOSUP  ", "OUTEL  ", "  CAV  ", "GAUGE  "],
+    "CONTROL ": ["MNCRSE ", "UPNECK ", "LONECK ", "MNFINE ", "UPMAIN ", "LOMAIN "],
+    " MISC   ": [" PK PH ", "  VCO  ", "   IF  ", "PRESS  ", " 1MHZ  ", " GAIN  ", "OFFSET ", "RAW REF"],
+    " TEMP   ": ["SUP PLT", " RCVR  ", "  MAIN ", "TOPCAB ", "LOWCAB ", "OUTEL  ", " CAV LF", " CAV RT"],
+}
+
+
+# Regex matching any metric line identifier in a single scan. Group 1 tags
+# status printout line 1, group 2 line 2, group 3 an analog channel set.
+metric_line_re = re.compile("(SYN)|(DGSW)|(" + "|".join(re.escape(set_id) for set_id in analog_chan_sets) + ")")
+
+# Slice bounds of the analog channel values in a raw analog channel line
+analog_chan_slices = [(15 + ichan * 8, 21 + ichan * 8) for ichan in range(8)]
+
+
+status_metric_specs = [
+    ("info", "name"),
+    ("utc_time", None),
+    ("autotuner_status_raw", "raw"),
+    ("autotuner_mode", "mode"),
+    ("autotuner_h2flux_state", "state"),
+    ("autotuner_measurement_state", "state"),
+    ("autotuner_measurement_count_seconds", None),
+    ("autotuner_h2flux_ctrl_device", "device"),
+    ("autotuner_sign", "sign"),
+    ("autotuner_max_diff", None),
+    ("autotuner_shift_direction", "direction"),
+    ("autotuner_bit_shift", None),
+    ("autotuner_dac1_chan", None),
+    ("autotuner_dac2_chan", None),
+    ("autotuner_measurement_msb", None),
+    ("autotuner_register_msb", None),
+    ("autotuner_register_number", None),
+    ("synthesizer_mode", "mode"),
+    ("synthesizer_number_a", None),
+    ("synthesizer_number_b", None),
+    ("synthesizer_number_c", None),
+    ("autotuner_wait_interval_seconds", None),
+    ("autotuner_count_seconds", None),
+    ("digital_status_word", None),
+    ("dac1_channel", None),
+    ("dac1_msb", None),
+    ("dac2_channel", None),
+    ("dac2_msb", None),
+]
+
+
+def build_analog_chan_meta():
+    """Build set and channel metric names for the analog channel sets.
+
+    Maps each analog channel set identifier to its metric-friendly set name
+    and a list of (channel name, metric name, lower index, upper index)
+    tuples, so the per-line parser does not have to redo the name
+    conversions or the slice arithmetic. Also records the minimum line
+    length needed for the set's channel values to be present.
+    """
+
+    meta = {}
+
+    for set_id, chan_ids in analog_chan_sets.items():
+        set_name = set_id.strip().replace(" ", "_").lower()
+        channels = []
+        for ichan, chan_id in enumerate(chan_ids):
+            chan_name = chan_id.strip().replace(" ", "_").lower()
+            index_lower, index_upper = analog_chan_slices[ichan]
+
+            # Hack for I.F. sense metric, which overflows space.
+            if chan_name == "if":
+                index_lower, index_upper = 30, 37
+
+            channels.append((chan_name, f"{set_name}_{chan_name}", index_lower, index_upper))
+
+        # Minimum line length for any channel value to be present.
+        min_line_length = max(index_upper for _, _, _, index_upper in channels)
+
+        meta[set_id] = (set_name, channels, min_line_length)
+
+    return meta
+
+
+# Precomputed metric names for the analog channel sets.
+analog_chan_meta = build_analog_chan_meta()
+
+
+def build_metric_templates():
+    """Build templates for all known metrics once at import time."""
+
+    templates = {}
+
+    # Templates for metrics from the status printout lines.
+    for metric_name, label_name in status_metric_specs:
+        templates[metric_name] = make_metric_template(metric_name, label_name)
+
+    # Templates for metrics from the analog channel lines.
+    for set_name, channels, min_line_length in analog_chan_meta.values():
+        for chan_name, metric_name, index_lower, index_upper in channels:
+            templates[metric_name] = make_metric_template(metric_name)
+
+    return templates
+
+
+# Reusable output buffers for the metrics files, keyed by file id. Cleared
+# and refilled on every parse, so steady-state parsing does not reallocate.
+metric_buffers = {}
+
+
+def get_metric_buffer(file_id):
+    """Get the reusable output buffer for a metrics file, cleared for reuse.
+
+    Parameters
+    ----------
+    file_id : str
+        Base name of metrics file the buffer is written to.
+    """
+
+    buf = metric_buffers.get(file_id)
+    if buf is None:
+        buf = metric_buffers[file_id] = bytearray()
+    buf.clear()
+    return buf
+
+
+def detect_metric_line(line):
+    """Detect relevant line with metrics and pass it to parser functions.
+
+    Parameters
+    ----------
+    line : str
+        Line of raw maser output.
+    """
+
+    match = metric_line_re.search(line)
+    if match is None:
+        return
+
+    if match.lastindex == 1:
+        parse_status_line1(line)
+    elif match.lastindex == 2:
+        parse_status_line2(line)
+    else:
+        parse_analog_chan_line(line, match.group(3))
+
+
+def parse_status_line1(line):
+    """Parse raw maser status printout line 1.
+
+    Parameters
+    ----------
+    line : str
+        Line 1 of raw maser status printout.
+    """
+
+    buf = get_metric_buffer("status1")
+
+    # Name of this maser
+    buf += metric_templates["info"].format(line[0:8]).encode("ascii", "replace")
+
+    # UTC date and time as given by maser in format YR DOY HR MIN SEC
+    # (parsed by hand, which is much cheaper than datetime.strptime)
+    try:
+        year = 2000 + int(line[9:11])
+        doy = int(line[12:15])
+        hour = int(line[16:18])
+        minute = int(line[19:21])
+        second = int(line[22:24])
+
+        # Validate field ranges like strptime would, so garbled fields fall
+        # back to -1 instead of rolling over into a wrong timestamp.
+        if not (1 <= doy <= 366 and 0 <= hour <= 23 and 0 <= minute <= 59 and 0 <= second <= 61):
+            raise ValueError("maser time field out of range")
+
+        maser_time_dt = datetime(year, 1, 1, tzinfo=timezone.utc) + timedelta(
+            days=doy - 1,
+            hours=hour,
+            minutes=minute,
+            seconds=second,
+        )
+        maser_time_unix = maser_time_dt.timestamp()
+    except ValueError:
+        maser_time_unix = -1
+    buf += metric_templates["utc_time"].format(maser_time_unix).encode("ascii", "replace")
+
+    # Autotuner status
+    buf += metric_templates["autotuner_status_raw"].format(line[25:45]).encode("ascii", "replace")
+    buf += metric_templates["autotuner_mode"].format(line[25]).encode("ascii", "replace")
+    buf += metric_templates["autotuner_h2flux_state"].format(line[26]).encode("ascii", "replace")
+    buf += metric_templates["autotuner_measurement_state"].format(line[27]).encode("ascii", "replace")
+    buf += metric_templates["autotuner_measurement_count_seconds"].format(str2int(line[28:30])).encode("ascii", "replace")
+    buf += metric_templates["autotuner_h2flux_ctrl_device"].format(line[30]).encode("ascii", "replace")
+    buf += metric_templates["autotuner_sign"].format(line[31]).encode("ascii", "replace")
+    buf += metric_templates["autotuner_max_diff"].format(str2int(line[32:38])).encode("ascii", "replace")
+    buf += metric_templates["autotuner_shift_direction"].format(line[38]).encode("ascii", "replace")
+    buf += metric_templates["autotuner_bit_shift"].format(str2int(line[39:41])).encode("ascii", "replace")
+    buf += metric_templates["autotuner_dac1_chan"].format(str2int(line[41:43])).encode("ascii", "replace")
+    buf += metric_templates["autotuner_dac2_chan"].format(str2int(line[43:45])).encode("ascii", "replace")
+
+    buf += metric_templates["autotuner_measurement_msb"].format(str2int(line[46:48])).encode("ascii", "replace")
+    buf += metric_templates["autotuner_register_msb"].format(str2int(line[49:51])).encode("ascii", "replace")
+
+    buf += metric_templates["autotuner_register_number"].format(str2int(line[52:58])).encode("ascii", "replace")
+
+    # Synthesizer status
+    buf += metric_templates["synthesizer_mode"].format(line[63]).encode("ascii", "replace")
+    buf += metric_templates["synthesizer_number_a"].format(str2int(line[65:69])).encode("ascii", "replace")
+    buf += metric_templates["synthesizer_number_b"].format(str2int(line[70:74])).encode("ascii", "replace")
+    buf += metric_templates["synthesizer_number_c"].format(str2int(line[75:78])).encode("ascii", "replace")
+
+    # Write metrics to file
+    write_metrics("status1", buf)
+
+
+def parse_status_line2(line):
+    """Parse raw maser status printout line 2.
+
+    Parameters
+    ----------
+    line : str
+        Line 2 of raw maser status printout.
+    """
+
+    buf = get_metric_buffer("status2")
+
+    # Autotuner wait interval and count
+    buf += metric_templates["autotuner_wait_interval_seconds"].format(str2int(line[0:3])).encode("ascii", "replace")
+    buf += metric_templates["autotuner_count_seconds"].format(str2int(line[5:9])).encode("ascii", "replace")
+
+    # Digital status word (convert from binary to decimal)
+    buf += metric_templates["digital_status_word"].format(str2int(line[15:27], 2)).encode("ascii", "replace")
+
+    # Digital-to-analog converter control words
+    buf += metric_templates["dac1_channel"].format(str2int(line[35:37])).encode("ascii", "replace")
+    buf += metric_templates["dac1_msb"].format(str2int(line[38:40])).encode("ascii", "replace")
+    buf += metric_templates["dac2_channel"].format(str2int(line[41:43])).encode("ascii", "replace")
+    buf += metric_templates["dac2_msb"].format(str2int(line[44:46])).encode("ascii", "replace")
+
+    # Write metrics to file
+    write_metrics("status2", buf)
+
+
+def parse_analog_chan_line(line, analog_set_id):
+    """Parse raw analog channels line.
+
+    Parameters
+    ----------
+    line : str
+        Line of raw analog channels metrics.
+    analog_set_id : str
+        Analog channel set identifier.
+    """
+
+    # Look up precomputed set and channel metric names.
+    analog_set_name, channels, min_line_length = analog_chan_meta[analog_set_id]
+
+    # Skip truncated lines, whose channel values would all parse as -1.
+    if len(line) < min_line_length:
+        return
+
+    buf = get_metric_buffer(analog_set_name)
+
+    # Loop through all analog channels in set (eight, minus spares).
+    any_valid = False
+    for chan_name, metric_name, index_lower, index_upper in channels:
+        # Parse analog channel value from raw maser metric line.
+        chan_val = str2float(line[index_lower:index_upper])
+        if chan_val != -1:
+            any_valid = True
+
+        # Add metric to data string.
+        buf += metric_templates[metric_name].format(chan_val).encode("ascii", "replace")
+
+    # Skip writing if no channel value could be parsed (garbled line).
+    if not any_valid:
+        return
+
+    # Write metrics to file.
+    write_metrics(analog_set_name, buf)
+
+
+def str2int(s, base=10):
+    """Convert string to integer with exception handling.
+
+    Parameters
+    ----------
+    s : str
+        String to parse.
+    base : int
+        Number format to convert to. Default value: 10
+    """
+
+    s = s.strip()
+
+    # Cheap pre-checks to avoid raising exceptions on blank and clearly
+    # non-numeric fields, which are common for spare channels.
+    if not s:
+        return -1
+    if base == 10 and not s.lstrip("+-").isdigit():
+        return -1
+
+    try:
+        i = int(s, base)
+    except ValueError:
+        i = -1
+
+    return i
+
+
+def str2float(s):
+    """Convert string to float with exception handling.
+
+    Parameters
+    ----------
+    s : str
+        String to parse.
+    """
+
+    s = s.strip()
+
+    # Cheap pre-check to avoid raising exceptions on blank fields.
+    if not s:
+        return -1
+
+    try:
+        f = float(s)
+    except ValueError:
+        f = -1
+
+    return f
+
+
+def make_metric_template(metric_name, label_name=None):
+    """Make template of metric string formatted for Prometheus.
+
+    The metric value (or label value, for labelled metrics) is left as a
+    placeholder to be filled in with str.format at parse time.
+
+    Parameters
+    ----------
+    metric_name : str
+        Name of metric.
+    label_name : str
+        Name of label whose value is filled in at parse time. Labelled
+        metrics always have value 1. Optional.
+    """
+
+    if label_name is None:
+        return f"{metrics_prefix}_{metric_name} {{}}\n"
+
+    return f'{metrics_prefix}_{metric_name}{{{{{label_name}="{{}}"}}}} 1\n'
+
+
+# Templates for all metrics known at import time.
+metric_templates = build_metric_templates()
+
+
+def write_metrics(file_id, data_bytes):
+    """Write metrics to prom file for scraping by node_exporter textfile collector.
+
+    First write metrics to temporary file, then rename temporary file to final file.
+    This avoids node exporter seeing half a file.
+
+    Parameters
+    ----------
+    file_id : str
+        Base name of file.
+    data_bytes : bytes-like
+        ASCII-encoded metrics data.
+    """
+
+    final_path = f"{metrics_dir}{metrics_prefix}_{file_id}.prom"
+
+    # Write out metrics to temporary file. Use the low-level os functions to
+    # skip construction of the buffered text io stack for these tiny writes.
+    temporary_path = f"{final_path}.$$"
+    fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, data_bytes)
+    finally:
+        os.close(fd)
+
+    # Rename temporary file to final file.
+    os.rename(temporary_path, final_path)